@@ -1,11 +1,10 @@
 import cv2
-import time
 import numpy as np
-import math
 import os
-import itertools
 from sys import stdout
-from threading import Thread
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 BOX_SAVE_DIR = './boxes/'
 
@@ -42,9 +41,11 @@ def gen_horiz_kernel(size, vclip):
     kernel[(size-clip):size] = 0
     return kernelt
 
+@lru_cache(maxsize=8)
 def circle_kern(w, h):
     ''' 
     Compute a circular kernel of width w and height h.
+    Results are cached, so callers must not modify the returned array.
 
     Parameters
     ----------
@@ -59,16 +60,14 @@ def circle_kern(w, h):
     center = (int(w/2), int(h/2))
     radius = min(center[0], center[1], w - center[0], h - center[1])
     Y, X = np.ogrid[:h, :w]
-    dist_from_center = np.sqrt((X - center[0])**2 + (Y - center[1])**2)
-    kernel = dist_from_center <= radius
+    dist_sq = (X - center[0])**2 + (Y - center[1])**2
+    kernel = dist_sq <= radius * radius
     return kernel.astype(np.uint8)
 
 def color_thresh(hsv_img, blur_rad, clip_size, lower_h, upper_h, sat_thresh, val_thresh):
     '''
     Generate a color threshhold from hsv img
     '''
-    blurred = cv2.blur(hsv_img, (blur_rad, blur_rad))  
-
     blurred = cv2.GaussianBlur(hsv_img, (blur_rad, blur_rad), 0)
     if lower_h > upper_h:
         min1 = np.array([0, sat_thresh, val_thresh], np.uint8)
@@ -183,6 +182,9 @@ def gen_hues(hi, hi2, lo):
                         int(hue[3] - 5 * 2.55)) # lower value bound, upper = 255
     return hues
 
+# hue bounds are fixed, so build them once rather than every frame
+HUES = gen_hues(75, 85, 45)
+
 
 def colorblock(image, frame_no, blur_size, clip_size, save_boxes=True):
     '''
@@ -208,16 +210,13 @@ def colorblock(image, frame_no, blur_size, clip_size, save_boxes=True):
     np array of uint32
         The video frame with overlaid contours, boxes, centroids, & color names.
     '''
-    hues = gen_hues(75, 85, 45)
-
     img_hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    img_gsc = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     h,w = image.shape[:2]
 
     # the layer for visualizations
     vis = np.zeros((h, w), np.uint8)
     
-    for hname, hue in hues.items():
+    for hname, hue in HUES.items():
         blank = np.zeros((h, w), np.uint8)
         threshd = color_thresh(img_hsv, blur_size, clip_size, hue[0], hue[1], hue[2], hue[3])
         ########## CONTOURS ##########
@@ -274,9 +273,9 @@ def colorblock(image, frame_no, blur_size, clip_size, save_boxes=True):
             cv2.circle(blank, (cX, cY), 3, (255, 255, 255))
             cv2.putText(blank, str(hname) + str(i), (cX - 20, cY - 20), cv2.FONT_HERSHEY_DUPLEX, 0.5, (255, 255, 255), 2)
         
-        vis = cv2.bitwise_or(vis, blank)
+        cv2.bitwise_or(vis, blank, dst=vis)
     vis = cv2.cvtColor(vis, cv2.COLOR_GRAY2BGR)
-    return cv2.bitwise_or(vis, image)
+    return cv2.bitwise_or(vis, image, dst=vis)
 
 if __name__ == "__main__":
     # source, url or filename
@@ -315,17 +314,26 @@ if __name__ == "__main__":
         print('writing to {}'.format(fileout))
 
         video_writer = cv2.VideoWriter(fileout, fourcc, 30, (w, h))
+        # frames are independent, so segment several at once; opencv releases
+        # the GIL, so threads are enough. results are written back in order.
+        workers = max(1, (os.cpu_count() or 1) // 2)
+        pending = deque()
         f = 0
-        while video.isOpened():
-            ret, frame = video.read()
-            if ret == True:
-                # display frame counter
-                stdout.write("\tframe {} of {}{}".format(f, total_frames, "\r"))
-                stdout.flush()
-                f += 1
-                frame = colorblock(frame, f, blur_size, clip_size, save_boxes=False)
-                video_writer.write(frame)
-            if ret == False:
-                break
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while video.isOpened():
+                ret, frame = video.read()
+                if ret == True:
+                    # display frame counter
+                    stdout.write("\tframe {} of {}{}".format(f, total_frames, "\r"))
+                    stdout.flush()
+                    f += 1
+                    pending.append(pool.submit(colorblock, frame, f, blur_size, clip_size, save_boxes=False))
+                    # bound the number of frames held in memory
+                    if len(pending) >= 2 * workers:
+                        video_writer.write(pending.popleft().result())
+                if ret == False:
+                    break
+            while pending:
+                video_writer.write(pending.popleft().result())
         video_writer.release()
         print('done! Wrote {} frames.'.format(f))